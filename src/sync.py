@@ -1,10 +1,20 @@
 import os
 import json
-import requests
+import calendar
+import contextlib
+import functools
+import hashlib
+import itertools
+import httpx
+import orjson
 import sys
-from datetime import datetime, timedelta
-from icalendar import Calendar, Event
-import pytz
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import MAXYEAR, MINYEAR, datetime, timedelta
+from typing import Any, Iterable
+
+MAX_WORKERS = 8 # Parallel timetable chunk requests
+TZID = 'Europe/Brussels' # Events are written as wall-clock times in this zone
 
 # --- CONFIGURATION & AUTH ---
 
@@ -25,8 +35,16 @@ def load_config():
     return {}
 
 def webuntis_login(config):
-    """Authenticate against WebUntis and return session + sessionId"""
-    session = requests.Session()
+    """Authenticate against WebUntis and return an HTTP/2 client carrying the session cookie"""
+    # Keep-alive + HTTP/2 lets the parallel timetable chunks share one connection
+    session = httpx.Client(
+        http2=True,
+        headers={"Content-Type": "application/json"}, # Bodies are pre-serialized with orjson
+        # httpx defaults to 5s; multi-week getTimetable calls can take longer, and a timed out chunk
+        # would silently drop weeks of lessons from the calendar
+        timeout=httpx.Timeout(60.0),
+        limits=httpx.Limits(max_connections=MAX_WORKERS, max_keepalive_connections=MAX_WORKERS)
+    )
     login_url = f"https://{config['server']}/WebUntis/jsonrpc.do?school={config['school']}"
     
     login_data = {
@@ -41,30 +59,33 @@ def webuntis_login(config):
     }
     
     try:
-        response = session.post(login_url, json=login_data)
+        response = session.post(login_url, content=orjson.dumps(login_data))
         response.raise_for_status()
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
+        session.close()
         raise Exception(f"Connection failed: {e}")
     
-    result = response.json()
+    result = orjson.loads(response.content)
     if 'error' in result:
+        session.close()
         raise Exception(f"Login failed: {result['error']}")
     
-    return session, result['result']['sessionId']
+    # Same domain/path as the cookie WebUntis sets itself, so this overwrites it instead of sending both
+    session.cookies.set('JSESSIONID', result['result']['sessionId'], domain=config['server'], path='/WebUntis')
+    return session
 
-def get_element_id(session, config, session_id):
+def get_element_id(session, config):
     """Get element ID (class or student)."""
     if config.get('class_id'):
         print(f"📚 Using configured class ID: {config['class_id']}")
         return int(config['class_id']), 1
     
     url = f"https://{config['server']}/WebUntis/jsonrpc.do?school={config['school']}"
-    headers = {"Cookie": f"JSESSIONID={session_id}"}
     
     # Try fetching classes
     data = {"id": "WebUntisSync", "method": "getKlassen", "params": {}, "jsonrpc": "2.0"}
-    response = session.post(url, json=data, headers=headers)
-    result = response.json()
+    response = session.post(url, content=orjson.dumps(data))
+    result = orjson.loads(response.content)
     
     if 'result' in result and len(result['result']) > 0:
         first_class = result['result'][0]
@@ -73,8 +94,8 @@ def get_element_id(session, config, session_id):
     
     # Try fetching student
     data = {"id": "WebUntisSync", "method": "getStudents", "params": {}, "jsonrpc": "2.0"}
-    response = session.post(url, json=data, headers=headers)
-    result = response.json()
+    response = session.post(url, content=orjson.dumps(data))
+    result = orjson.loads(response.content)
     
     if 'result' in result and len(result['result']) > 0:
         student = result['result'][0]
@@ -85,167 +106,241 @@ def get_element_id(session, config, session_id):
 
 # --- TIMETABLE FETCHING ---
 
-def get_timetable(session, config, session_id, element_id, element_type, start_date, end_date):
-    """Fetch timetable data from WebUntis in chunks"""
-    full_timetable = []
+def _ymd(d):
+    """Format a date as WebUntis YYYYMMDD without going through strftime"""
+    return f"{d.year:04d}{d.month:02d}{d.day:02d}"
+
+def _fetch_chunk(session, url, options, start, end):
+    """Fetch a single timetable chunk, returns an empty list on failure"""
+    # Only the date range differs per chunk; the static options are shared (read-only across threads)
+    data = {
+        "id": "WebUntisSync",
+        "method": "getTimetable",
+        "params": {
+            "options": {
+                **options,
+                "startDate": _ymd(start),
+                "endDate": _ymd(end)
+            }
+        },
+        "jsonrpc": "2.0"
+    }
+    
+    try:
+        response = session.post(url, content=orjson.dumps(data))
+        result = orjson.loads(response.content)
+        
+        if 'error' in result:
+            print(f"   ⚠️ Error fetching chunk {start}: {result['error']['message']}")
+            return []
+        return result.get('result', [])
+            
+    except Exception as e:
+        print(f"   ⚠️ Exception fetching chunk: {e}")
+        return []
+
+def get_lessons(session, config, element_id, element_type, start_date, end_date):
+    """
+    Fetch timetable data from WebUntis in parallel chunks and process each chunk as soon as it arrives.
+    Returns the merged lessons in chronological order and the number of raw items fetched.
+    """
     chunk_size = 28 # 4 weeks per chunk
-    current_start = start_date
     
     print(f"🔄 Fetching timetable in chunks from {start_date} to {end_date}...")
 
+    # Build all chunk ranges up-front so they can be dispatched concurrently
+    ranges = []
+    current_start = start_date
     while current_start < end_date:
         current_end = min(current_start + timedelta(days=chunk_size), end_date)
-        
-        url = f"https://{config['server']}/WebUntis/jsonrpc.do?school={config['school']}"
-        data = {
-            "id": "WebUntisSync",
-            "method": "getTimetable",
-            "params": {
-                "options": {
-                    "element": {"id": element_id, "type": element_type},
-                    "startDate": current_start.strftime("%Y%m%d"),
-                    "endDate": current_end.strftime("%Y%m%d"),
-                    "showBooking": True, 
-                    "showInfo": True,        
-                    "showSubstText": True,   
-                    "showLsText": True,      
-                    "showStudentgroup": True,
-                    "klasseFields": ["id", "name", "longname"],
-                    "roomFields": ["id", "name", "longname"],
-                    "subjectFields": ["id", "name", "longname"],
-                    "teacherFields": ["id", "name", "longname"]
-                }
-            },
-            "jsonrpc": "2.0"
-        }
-        
-        headers = {"Cookie": f"JSESSIONID={session_id}"}
-        
-        try:
-            response = session.post(url, json=data, headers=headers)
-            result = response.json()
-            
-            if 'error' in result:
-                print(f"   ⚠️ Error fetching chunk {current_start}: {result['error']['message']}")
-            else:
-                items = result.get('result', [])
-                full_timetable.extend(items)
-                
-        except Exception as e:
-            print(f"   ⚠️ Exception fetching chunk: {e}")
-
+        ranges.append((current_start, current_end))
         current_start = current_end + timedelta(days=1)
+
+    if not ranges:
+        return [], 0
+
+    url = f"https://{config['server']}/WebUntis/jsonrpc.do?school={config['school']}"
+    options = {
+        "element": {"id": element_id, "type": element_type},
+        "showBooking": True, 
+        "showInfo": True,        
+        "showSubstText": True,   
+        "showLsText": True,      
+        "showStudentgroup": True,
+        "klasseFields": ["id", "name", "longname"],
+        "roomFields": ["id", "name", "longname"],
+        "subjectFields": ["id", "name", "longname"],
+        "teacherFields": ["id", "name", "longname"]
+    }
+
+    processed_chunks = [[] for _ in ranges]
+    raw_count = 0
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(ranges))) as executor:
+        futures = {
+            executor.submit(_fetch_chunk, session, url, options, start, end): index
+            for index, (start, end) in enumerate(ranges)
+        }
+        # Merges never cross a day and chunks cover disjoint days, so every chunk can be
+        # merged on its own while the remaining ones are still downloading
+        for future in as_completed(futures):
+            raw_items = future.result()
+            raw_count += len(raw_items)
+            processed_chunks[futures[future]] = process_timetable(raw_items)
     
-    return full_timetable
+    return list(itertools.chain.from_iterable(processed_chunks)), raw_count
 
-def parse_webuntis_time(date_int, time_int):
-    """Convert WebUntis date/time ints to datetime object"""
-    date_str = str(date_int)
-    time_str = str(time_int).zfill(4)
-    return datetime.strptime(f"{date_str}{time_str}", "%Y%m%d%H%M")
+@functools.lru_cache(maxsize=4096)
+def parse_webuntis_time(date_int: int, time_int: int) -> datetime:
+    """Convert WebUntis date/time ints (e.g. 20240115, 830) to datetime object"""
+    year, month_day = divmod(date_int, 10000)
+    month, day = divmod(month_day, 100)
+    hour, minute = divmod(time_int, 100)
+    return datetime(year, month, day, hour, minute)
 
 # --- MERGING LOGIC HELPER ---
 
-def merge_unique_text(current_text, new_text):
+# A text field stays the raw WebUntis string until it is merged, then becomes ordered unique parts
+TextField = str | dict[str, None]
+
+def _text_parts(text: TextField) -> dict[str, None]:
     """
-    Merges two strings with ' | ' separator, ensuring no duplicates exist.
-    Example: merge('A', 'A') -> 'A'
-    Example: merge('A | B', 'A') -> 'A | B'
+    Split a ' | ' separated text field into an insertion-ordered set (dict keys).
+    Example: _text_parts('A | B') -> {'A': None, 'B': None}
     """
-    if not current_text:
-        return new_text
-    if not new_text:
-        return current_text
-    
-    # Split by separator, strip whitespace, remove empty strings
-    parts = [p.strip() for p in current_text.split('|') if p.strip()]
-    new_parts = [p.strip() for p in new_text.split('|') if p.strip()]
-    
-    for part in new_parts:
-        if part not in parts:
-            parts.append(part)
-            
-    return ' | '.join(parts)
+    if isinstance(text, dict):
+        return text
+    return dict.fromkeys(p for p in (part.strip() for part in text.split('|')) if p)
+
+def _merge_text(current: TextField, new: TextField) -> TextField:
+    """
+    Merges two text fields, ensuring no duplicate parts exist.
+    A field is left untouched when the other side is empty.
+    Example: _merge_text('A | B', 'A') -> {'A': None, 'B': None}
+    """
+    if not new:
+        return current
+    if not current:
+        return new if isinstance(new, str) else dict(new)
+    current = _text_parts(current)
+    current.update(_text_parts(new))
+    return current
+
+def _text_value(text: TextField) -> str:
+    """Render a text field for output"""
+    return text if isinstance(text, str) else ' | '.join(text)
+
+def _names(items: Iterable[dict[str, Any]]) -> dict[str, None]:
+    """Collect the display names (longname, falling back to name) of WebUntis elements"""
+    return dict.fromkeys(i.get('longname') or i.get('name') or '' for i in items)
 
 class ProcessedLesson:
     """Helper class to manage lesson data for merging"""
-    def __init__(self, raw_lesson):
-        self.id = raw_lesson['id']
-        self.date = raw_lesson['date']
-        self.start_time = raw_lesson['startTime']
-        self.end_time = raw_lesson['endTime']
+    def __init__(self, raw_lesson: dict[str, Any]) -> None:
+        self.id: int = raw_lesson['id']
+        self.date: int = raw_lesson['date']
+        self.start_time: int = raw_lesson['startTime']
+        self.end_time: int = raw_lesson['endTime']
+        self.start_dt: datetime = parse_webuntis_time(self.date, self.start_time)
+        self.end_dt: datetime = parse_webuntis_time(self.date, self.end_time)
         
         # Determine Subject Name (Key for merging)
-        subjects = raw_lesson.get('su', [])
-        self.subject_name = subjects[0].get('longname') or subjects[0].get('name') if subjects else "Lesson"
+        subjects = raw_lesson.get('su', ())
+        self.subject_name: str = subjects[0].get('longname') or subjects[0].get('name') if subjects else "Lesson"
         
-        # Use Sets to avoid duplicates when merging
-        self.subjects = {su.get('longname') or su.get('name', '') for su in subjects}
-        self.teachers = {te.get('longname') or te.get('name', '') for te in raw_lesson.get('te', [])}
-        self.rooms = {ro.get('longname') or ro.get('name', '') for ro in raw_lesson.get('ro', [])}
-        self.classes = {kl.get('longname') or kl.get('name', '') for kl in raw_lesson.get('kl', [])}
+        # Insertion-ordered sets (dict keys) to avoid duplicates when merging
+        self.subjects: dict[str, None] = _names(subjects)
+        self.teachers: dict[str, None] = _names(raw_lesson.get('te', ()))
+        self.rooms: dict[str, None] = _names(raw_lesson.get('ro', ()))
+        self.classes: dict[str, None] = _names(raw_lesson.get('kl', ()))
         
-        # Text fields
-        self.info = raw_lesson.get('info', '')
-        self.lstext = raw_lesson.get('lstext', '') 
-        self.subst_text = raw_lesson.get('substText', '')
+        # Text fields, split into unique parts only once they are merged
+        self.info: TextField = raw_lesson.get('info') or ''
+        self.lstext: TextField = raw_lesson.get('lstext') or ''
+        self.subst_text: TextField = raw_lesson.get('substText') or ''
         
-        self.code = raw_lesson.get('code', '') # e.g. 'cancelled'
-
-    @property
-    def start_dt(self):
-        return parse_webuntis_time(self.date, self.start_time)
+        self.code: str = raw_lesson.get('code', '') # e.g. 'cancelled'
+        self._update_signature()
 
-    @property
-    def end_dt(self):
-        return parse_webuntis_time(self.date, self.end_time)
+    def _update_signature(self) -> None:
+        """Hashable snapshot of the content used to detect adjacent identical blocks"""
+        self._sig: tuple[str, frozenset[str], frozenset[str], frozenset[str]] = (self.subject_name, frozenset(self.teachers), frozenset(self.rooms), frozenset(self.classes))
 
-    def merge_with(self, other):
+    def merge_with(self, other: 'ProcessedLesson') -> None:
         """Merge details from another overlapping lesson into this one"""
         self.subjects.update(other.subjects)
         self.teachers.update(other.teachers)
         self.rooms.update(other.rooms)
         self.classes.update(other.classes)
         
-        # Merge text fields using the unique helper
-        self.info = merge_unique_text(self.info, other.info)
-        self.lstext = merge_unique_text(self.lstext, other.lstext)
-        self.subst_text = merge_unique_text(self.subst_text, other.subst_text)
+        # Merge text fields uniquely
+        self.info = _merge_text(self.info, other.info)
+        self.lstext = _merge_text(self.lstext, other.lstext)
+        self.subst_text = _merge_text(self.subst_text, other.subst_text)
+        self._update_signature()
+
+def _is_valid_time(time_int: Any) -> bool:
+    """Check a WebUntis HHMM time int"""
+    if not isinstance(time_int, int) or time_int < 0:
+        return False
+    hour, minute = divmod(time_int, 100)
+    return hour < 24 and minute < 60
+
+def _is_valid_lesson(raw: dict[str, Any]) -> bool:
+    """Check the fields ProcessedLesson relies on, warning about lessons that will be skipped"""
+    date_int = raw.get('date')
+    if 'id' not in raw or not isinstance(date_int, int) or date_int <= 0:
+        _warn_malformed(raw)
+        return False
+    
+    year, month_day = divmod(date_int, 10000)
+    month, day = divmod(month_day, 100)
+    if not (
+        MINYEAR <= year <= MAXYEAR and
+        1 <= month <= 12 and
+        1 <= day <= calendar.monthrange(year, month)[1] and
+        _is_valid_time(raw.get('startTime')) and
+        _is_valid_time(raw.get('endTime'))
+    ):
+        _warn_malformed(raw)
+        return False
+    return True
 
-def process_timetable(raw_timetable):
+def _warn_malformed(raw: dict[str, Any]) -> None:
+    print(f"   ⚠️ Skipping malformed lesson {raw.get('id')}: date={raw.get('date')} start={raw.get('startTime')} end={raw.get('endTime')}")
+
+def process_timetable(raw_timetable: list[dict[str, Any]]) -> list[ProcessedLesson]:
     """
     1. Filter cancellations
     2. Convert to objects
     3. Merge overlaps (same time, same subject)
     4. Merge adjacent (same subject/teachers, continuous time)
     """
-    # 1. Convert to ProcessedLesson objects
-    lessons = []
-    for raw in raw_timetable:
-        if raw.get('code') == 'cancelled':
-            continue
-        try:
-            lessons.append(ProcessedLesson(raw))
-        except ValueError:
-            continue
+    # 1. Convert to ProcessedLesson objects, skipping cancellations and malformed entries before construction
+    lessons = [
+        ProcessedLesson(raw) for raw in raw_timetable
+        if raw.get('code') != 'cancelled' and _is_valid_lesson(raw)
+    ]
 
     if not lessons:
         return []
 
-    # Sort primarily by start time
+    # Sort primarily by start time (stable, so lessons of one subject keep their response order)
     lessons.sort(key=lambda x: (x.start_dt, x.subject_name))
 
     # 2. HORIZONTAL MERGE: Combine items at the EXACT SAME time and Subject
-    merged_overlaps = {}
+    consolidated_list: list[ProcessedLesson] = []
     
-    for lesson in lessons:
-        key = (lesson.start_dt, lesson.end_dt, lesson.subject_name)
-        if key in merged_overlaps:
-            merged_overlaps[key].merge_with(lesson)
-        else:
-            merged_overlaps[key] = lesson
-
-    consolidated_list = sorted(merged_overlaps.values(), key=lambda x: x.start_dt)
+    for _, group in itertools.groupby(lessons, key=lambda x: (x.start_dt, x.subject_name)):
+        # Split the slot by end time in first-seen order; the vertical merge depends on this order
+        by_end: dict[datetime, ProcessedLesson] = {}
+        for lesson in group:
+            first = by_end.get(lesson.end_dt)
+            if first is None:
+                by_end[lesson.end_dt] = lesson
+            else:
+                first.merge_with(lesson)
+        consolidated_list.extend(by_end.values())
 
     # 3. VERTICAL MERGE: Combine adjacent blocks (e.g. 9-10 and 10-11)
     if not consolidated_list:
@@ -257,22 +352,18 @@ def process_timetable(raw_timetable):
         previous = final_lessons[-1]
 
         # Check conditions for merging adjacent blocks
-        is_continuous = (previous.end_dt == current.start_dt)
-        is_same_content = (
-            previous.subject_name == current.subject_name and
-            previous.teachers == current.teachers and
-            previous.rooms == current.rooms and
-            previous.classes == current.classes
-        )
+        is_continuous = (previous.date == current.date and previous.end_time == current.start_time)
+        is_same_content = (previous._sig == current._sig)
 
         if is_continuous and is_same_content:
             # Extend the previous lesson's end time
             previous.end_time = current.end_time
+            previous.end_dt = current.end_dt
             
             # Merge text fields uniquely
-            previous.info = merge_unique_text(previous.info, current.info)
-            previous.lstext = merge_unique_text(previous.lstext, current.lstext)
-            previous.subst_text = merge_unique_text(previous.subst_text, current.subst_text)
+            previous.info = _merge_text(previous.info, current.info)
+            previous.lstext = _merge_text(previous.lstext, current.lstext)
+            previous.subst_text = _merge_text(previous.subst_text, current.subst_text)
         else:
             final_lessons.append(current)
 
@@ -280,6 +371,120 @@ def process_timetable(raw_timetable):
 
 # --- ICS GENERATION ---
 
+# Escape table for TEXT property values (RFC 5545, 3.3.11), carriage returns are dropped
+# so CRLF line breaks from WebUntis end up as a single escaped newline
+_ICS_ESCAPE = str.maketrans({'\\': '\\\\', ';': '\\;', ',': '\\,', '\n': '\\n', '\r': None})
+
+# Static timezone definition for TZID, built once
+_VTIMEZONE = (
+    "BEGIN:VTIMEZONE",
+    f"TZID:{TZID}",
+    "BEGIN:STANDARD",
+    "DTSTART:19701025T030000",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "TZOFFSETFROM:+0200",
+    "TZOFFSETTO:+0100",
+    "TZNAME:CET",
+    "END:STANDARD",
+    "BEGIN:DAYLIGHT",
+    "DTSTART:19700329T020000",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0200",
+    "TZNAME:CEST",
+    "END:DAYLIGHT",
+    "END:VTIMEZONE",
+)
+
+def _fold(line):
+    """Fold a content line to 75 octets per physical line, never splitting a UTF-8 character"""
+    if len(line.encode('utf-8')) <= 75:
+        return line
+    parts = []
+    current = []
+    size = 0
+    limit = 75
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > limit:
+            parts.append(''.join(current))
+            current = []
+            size = 0
+            limit = 74 # Continuation lines start with a space
+        current.append(char)
+        size += char_size
+    parts.append(''.join(current))
+    return '\r\n '.join(parts)
+
+def _emit_event(buf, lesson, tz_name):
+    """Append the VEVENT lines for a lesson to buf"""
+    # Text fields
+    lstext = _text_value(lesson.lstext)
+    info = _text_value(lesson.info)
+    subst_text = _text_value(lesson.subst_text)
+    
+    # Summary
+    summary = ', '.join(lesson.subjects) if lesson.subjects else 'Lesson'
+    if subst_text:
+        summary = f"{summary} ({subst_text})"
+    
+    # Description Construction
+    description_parts = []
+    if lesson.teachers:
+        description_parts.append(' / '.join(lesson.teachers))
+    if lesson.classes:
+        description_parts.append(' / '.join(lesson.classes))
+    
+    # Add a separator if there is info to display
+    if lstext or info or subst_text:
+        description_parts.append("-" * 20)
+        
+    # Add the 'Lesinformatie' (lstext) and other info
+    if lstext:
+        description_parts.append(f"ℹ️ {lstext}")
+    if info:
+        description_parts.append(f"📝 {info}")
+    if subst_text:
+        description_parts.append(f"🔄 {subst_text}")
+    
+    buf.append("BEGIN:VEVENT")
+    buf.append(_fold(f"SUMMARY:{summary.translate(_ICS_ESCAPE)}"))
+    # Wall-clock times straight from the WebUntis ints, the offset is resolved by the client through TZID
+    buf.append(f"DTSTART;TZID={tz_name}:{lesson.date}T{lesson.start_time:04d}00")
+    buf.append(f"DTEND;TZID={tz_name}:{lesson.date}T{lesson.end_time:04d}00")
+    buf.append(_fold(f"UID:{lesson.id}-{lesson.date}-{lesson.start_time}@webuntis-sync"))
+    if description_parts:
+        description = '\n'.join(description_parts)
+        buf.append(_fold(f"DESCRIPTION:{description.translate(_ICS_ESCAPE)}"))
+    # Location
+    if lesson.rooms:
+        buf.append(_fold(f"LOCATION:{', '.join(lesson.rooms).translate(_ICS_ESCAPE)}"))
+    buf.append("END:VEVENT")
+
+def write_if_changed(path, data):
+    """
+    Atomically replace path with data, unless the file already has the same content.
+    Returns True if the file was written.
+    """
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+                return False
+    
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    # Write next to the target so os.replace stays on the same filesystem
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.ics')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644) # mkstemp creates the file owner-only
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
 def sync_calendar():
     """Main function"""
     config = load_config()
@@ -287,12 +492,6 @@ def sync_calendar():
     if not config:
         raise Exception("Configuration not found.")
 
-    print("🔐 Logging in...")
-    session, session_id = webuntis_login(config)
-    
-    print("🔍 Finding element...")
-    element_id, element_type = get_element_id(session, config, session_id)
-    
     # Date range
     days_back = 60
     days_forward = 120
@@ -300,76 +499,37 @@ def sync_calendar():
     start_date = today - timedelta(days=days_back)
     end_date = today + timedelta(days=days_forward)
     
-    print(f"📅 Fetching raw data {start_date} to {end_date}...")
-    raw_timetable = get_timetable(session, config, session_id, element_id, element_type, start_date, end_date)
-    
-    print(f"⚙️ Processing and merging {len(raw_timetable)} raw items...")
-    processed_lessons = process_timetable(raw_timetable)
+    print("🔐 Logging in...")
+    # closing() rather than the client's own context manager: httpx refuses to re-enter
+    # a client that already sent the login request
+    with contextlib.closing(webuntis_login(config)) as session:
+        print("🔍 Finding element...")
+        element_id, element_type = get_element_id(session, config)
+        
+        print(f"📅 Fetching and merging data {start_date} to {end_date}...")
+        processed_lessons, raw_count = get_lessons(session, config, element_id, element_type, start_date, end_date)
     
     # Setup Calendar
-    cal = Calendar()
-    cal.add('prodid', '-//WebUntis Sync//webuntis-sync//EN')
-    cal.add('version', '2.0')
-    cal.add('x-wr-calname', 'WebUntis Timetable')
-    cal.add('x-wr-timezone', 'Europe/Brussels')
-    timezone = pytz.timezone('Europe/Brussels')
+    buf = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//WebUntis Sync//webuntis-sync//EN",
+        "X-WR-CALNAME:WebUntis Timetable",
+        f"X-WR-TIMEZONE:{TZID}",
+    ]
+    buf.extend(_VTIMEZONE)
     
     for lesson in processed_lessons:
-        event = Event()
-        
-        # Prepare sorted lists
-        s_subjects = sorted(list(lesson.subjects))
-        s_teachers = sorted(list(lesson.teachers))
-        s_classes = sorted(list(lesson.classes))
-        s_rooms = sorted(list(lesson.rooms))
-        
-        # Summary
-        summary = ', '.join(s_subjects) if s_subjects else 'Lesson'
-        if lesson.subst_text:
-            summary = f"{summary} ({lesson.subst_text})"
-        
-        event.add('summary', summary)
-        event.add('dtstart', timezone.localize(lesson.start_dt))
-        event.add('dtend', timezone.localize(lesson.end_dt))
-        
-        # Description Construction
-        description_parts = []
-        if s_teachers:
-            description_parts.append(' / '.join(s_teachers))
-        if s_classes:
-            description_parts.append(' / '.join(s_classes))
-        
-        # Add a separator if there is info to display
-        if lesson.lstext or lesson.info or lesson.subst_text:
-            description_parts.append("-" * 20)
-            
-        # Add the 'Lesinformatie' (lstext) and other info
-        if lesson.lstext:
-            description_parts.append(f"ℹ️ {lesson.lstext}")
-        if lesson.info:
-            description_parts.append(f"📝 {lesson.info}")
-        if lesson.subst_text:
-            description_parts.append(f"🔄 {lesson.subst_text}")
-            
-        if description_parts:
-            event.add('description', '\n'.join(description_parts))
-            
-        # Location
-        if s_rooms:
-            event.add('location', ', '.join(s_rooms))
-            
-        # UID
-        uid = f"{lesson.id}-{lesson.date}-{lesson.start_time}@webuntis-sync"
-        event.add('uid', uid)
-        
-        cal.add_component(event)
+        _emit_event(buf, lesson, TZID)
+    
+    buf.append("END:VCALENDAR")
     
-    # Save
-    os.makedirs('docs', exist_ok=True)
-    with open('docs/calendar.ics', 'wb') as f:
-        f.write(cal.to_ical())
+    # Save (skipped when unchanged so downstream caches stay valid)
+    data = ('\r\n'.join(buf) + '\r\n').encode('utf-8')
+    if not write_if_changed('docs/calendar.ics', data):
+        print("ℹ️ Calendar unchanged, not rewriting docs/calendar.ics")
     
-    print(f"✅ Calendar synced: {len(processed_lessons)} events (merged from {len(raw_timetable)} items).")
+    print(f"✅ Calendar synced: {len(processed_lessons)} events (merged from {raw_count} items).")
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,65 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from sync import _ICS_ESCAPE, ProcessedLesson, _emit_event, _fold
+
+
+def test_fold_keeps_short_lines_intact():
+    line = 'SUMMARY:' + 'a' * 67
+    assert len(line.encode('utf-8')) == 75
+    assert _fold(line) == line
+
+
+def test_fold_octet_limits():
+    line = 'DESCRIPTION:' + 'a' * 200
+    physical = _fold(line).split('\r\n')
+    assert len(physical[0].encode('utf-8')) == 75
+    for continuation in physical[1:]:
+        assert continuation.startswith(' ')
+        assert len(continuation.encode('utf-8')) <= 75
+    assert len(physical[1].encode('utf-8')) == 75
+    assert ''.join([physical[0]] + [p[1:] for p in physical[1:]]) == line
+
+
+def test_fold_never_splits_multibyte_characters():
+    line = 'DESCRIPTION:' + 'é' * 40 + '📝' * 20
+    physical = _fold(line).split('\r\n')
+    assert len(physical) > 1
+    for part in physical:
+        # Every physical line must be valid UTF-8 on its own
+        assert len(part.encode('utf-8')) <= 75
+        part.encode('utf-8').decode('utf-8')
+    assert ''.join([physical[0]] + [p[1:] for p in physical[1:]]) == line
+
+
+def test_escape_text_values():
+    assert 'a\\b;c,d\ne\r\nf'.translate(_ICS_ESCAPE) == 'a\\\\b\\;c\\,d\\ne\\nf'
+
+
+def test_emit_event_golden():
+    lesson = ProcessedLesson({
+        'id': 42,
+        'date': 20260610,
+        'startTime': 800,
+        'endTime': 950,
+        'su': [{'name': 'LS', 'longname': 'Linux services'}],
+        'te': [{'name': 'Man'}, {'name': 'Van'}],
+        'ro': [{'longname': '01.37 aula'}],
+        'kl': [{'name': '1IT_CSC1'}],
+        'lstext': 'Examen; deel 1, 2',
+        'substText': 'Vervanging',
+    })
+    buf = []
+    _emit_event(buf, lesson, 'Europe/Brussels')
+    assert buf == [
+        'BEGIN:VEVENT',
+        'SUMMARY:Linux services (Vervanging)',
+        'DTSTART;TZID=Europe/Brussels:20260610T080000',
+        'DTEND;TZID=Europe/Brussels:20260610T095000',
+        'UID:42-20260610-800@webuntis-sync',
+        'DESCRIPTION:Man / Van\\n1IT_CSC1\\n--------------------\\nℹ️ Examen\\; deel\r\n  1\\, 2\\n🔄 Vervanging',
+        'LOCATION:01.37 aula',
+        'END:VEVENT',
+    ]
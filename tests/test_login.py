@@ -0,0 +1,34 @@
+import contextlib
+import functools
+import os
+import sys
+
+import httpx
+import orjson
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import sync
+
+CONFIG = {'server': 'school.webuntis.com', 'school': 'demo', 'username': 'u', 'password': 'p'}
+
+
+def test_session_cookie_is_sent_once(monkeypatch):
+    sent_cookies = []
+
+    def handler(request):
+        method = orjson.loads(request.content)['method']
+        if method == 'authenticate':
+            return httpx.Response(
+                200,
+                headers={'Set-Cookie': 'JSESSIONID=SID1; Path=/WebUntis; HttpOnly'},
+                content=orjson.dumps({'result': {'sessionId': 'SID1'}}),
+            )
+        sent_cookies.append(request.headers.get('Cookie'))
+        return httpx.Response(200, content=orjson.dumps({'result': [{'id': 7, 'name': '1A'}]}))
+
+    monkeypatch.setattr(sync.httpx, 'Client', functools.partial(httpx.Client, transport=httpx.MockTransport(handler)))
+
+    with contextlib.closing(sync.webuntis_login(CONFIG)) as session:
+        assert sync.get_element_id(session, CONFIG) == (7, 1)
+    assert sent_cookies == ['JSESSIONID=SID1']
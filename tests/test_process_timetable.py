@@ -0,0 +1,106 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from sync import ProcessedLesson, _text_value, process_timetable
+
+
+def _lesson(lesson_id, start, end, subject, teacher='T', date=20260610):
+    return {
+        'id': lesson_id,
+        'date': date,
+        'startTime': start,
+        'endTime': end,
+        'su': [{'name': subject}],
+        'te': [{'name': teacher}],
+    }
+
+
+def _baseline_merge(raw_timetable):
+    """The original dict-based horizontal merge + vertical merge, used as reference"""
+    lessons = [ProcessedLesson(raw) for raw in raw_timetable if raw.get('code') != 'cancelled']
+    lessons.sort(key=lambda x: (x.start_dt, x.subject_name))
+
+    merged_overlaps = {}
+    for lesson in lessons:
+        key = (lesson.start_dt, lesson.end_dt, lesson.subject_name)
+        if key in merged_overlaps:
+            merged_overlaps[key].merge_with(lesson)
+        else:
+            merged_overlaps[key] = lesson
+    consolidated_list = sorted(merged_overlaps.values(), key=lambda x: x.start_dt)
+    if not consolidated_list:
+        return []
+
+    final_lessons = [consolidated_list[0]]
+    for current in consolidated_list[1:]:
+        previous = final_lessons[-1]
+        is_continuous = (previous.end_dt == current.start_dt)
+        is_same_content = (
+            previous.subject_name == current.subject_name and
+            set(previous.teachers) == set(current.teachers) and
+            set(previous.rooms) == set(current.rooms) and
+            set(previous.classes) == set(current.classes)
+        )
+        if is_continuous and is_same_content:
+            previous.end_time = current.end_time
+            previous.end_dt = current.end_dt
+        else:
+            final_lessons.append(current)
+    return final_lessons
+
+
+def _blocks(lessons):
+    return [(l.date, l.start_time, l.end_time, l.subject_name, frozenset(l.teachers)) for l in lessons]
+
+
+def test_parallel_lessons_with_different_end_times():
+    raw = [
+        _lesson(1, 900, 1100, 'Bio'),
+        _lesson(2, 900, 1000, 'Math'),
+        _lesson(3, 1000, 1100, 'Math'),
+    ]
+    result = _blocks(process_timetable(raw))
+    assert result == [
+        (20260610, 900, 1100, 'Bio', frozenset({'T'})),
+        (20260610, 900, 1100, 'Math', frozenset({'T'})),
+    ]
+
+
+def test_matches_baseline_merge():
+    rng = random.Random(0)
+    for _ in range(500):
+        raw = []
+        for lesson_id in range(rng.randint(1, 12)):
+            start = rng.choice([800, 900, 1000, 1100])
+            end = start + rng.choice([100, 200])
+            raw.append(_lesson(
+                lesson_id, start, end,
+                rng.choice(['Bio', 'Math', 'Chem']),
+                teacher=rng.choice(['A', 'B']),
+                date=rng.choice([20260610, 20260611]),
+            ))
+        assert _blocks(process_timetable(raw)) == _blocks(_baseline_merge(raw))
+
+
+def test_malformed_lessons_are_skipped():
+    raw = [
+        _lesson(1, 900, 1000, 'Bio'),
+        _lesson(2, 900, 1000, 'Math', date=20261340),
+        _lesson(3, 975, 1000, 'Chem'),
+        {'id': 4, 'date': 20260610, 'startTime': 900},
+    ]
+    assert _blocks(process_timetable(raw)) == [(20260610, 900, 1000, 'Bio', frozenset({'T'}))]
+
+
+def test_unmerged_text_is_kept_verbatim():
+    raw = [
+        dict(_lesson(1, 900, 1000, 'Bio'), info='Toets H3|H4 '),
+        dict(_lesson(2, 1100, 1200, 'Math'), info='A | B'),
+        dict(_lesson(3, 1100, 1200, 'Math'), info='A'),
+    ]
+    bio, math = process_timetable(raw)
+    assert _text_value(bio.info) == 'Toets H3|H4 '
+    assert _text_value(math.info) == 'A | B'